@@ -1,8 +1,32 @@
 import streamlit as st
 import requests
 import json
+import os
 import datetime
 import re
+import heapq
+import threading
+import time
+import contextvars
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from notion_sync import (
+    BACKGROUND_REQUESTS,
+    CORPUS,
+    REQUEST_BUDGET,
+    RESULT_CACHE,
+    RequestBudget,
+    RequestBudgetExceeded,
+    configure_rate_limits,
+    notion_request,
+    start_background_thread,
+    start_change_feed,
+    utc_minute,
+)
+from notion_text import analyze_pages, text_from_raw_blocks
 
 # =================== НАСТРОЙКА СТРАНИЦЫ ===================
 st.set_page_config(
@@ -16,49 +40,90 @@ st.set_page_config(
 SERPER_API_KEY = st.secrets.get("SERPER_API_KEY", "")
 OMDB_API_KEY = st.secrets.get("OMDB_API_KEY", "")
 NOTION_API_KEY = st.secrets.get("NOTION_API_KEY", "")
+NOTION_RATE_LIMIT = float(st.secrets.get("NOTION_RATE_LIMIT", 3))
+BACKGROUND_RATE_SHARE = float(st.secrets.get("BACKGROUND_RATE_SHARE", 0.5))
+CPU_WORKERS = int(st.secrets.get("CPU_WORKERS", 0))
+DEEP_SEARCH_MAX_PAGES = int(st.secrets.get("DEEP_SEARCH_MAX_PAGES", 1000))
+DEEP_SEARCH_FETCH_LIMIT = int(st.secrets.get("DEEP_SEARCH_FETCH_LIMIT", 30))
+CHANGE_FEED_INTERVAL = float(st.secrets.get("CHANGE_FEED_INTERVAL", 60))
+CHANGE_FEED_MAX_INTERVAL = float(st.secrets.get("CHANGE_FEED_MAX_INTERVAL", 900))
+CHANGE_FEED_FULL_SYNC = float(st.secrets.get("CHANGE_FEED_FULL_SYNC", 3600))
+CHANGE_FEED_OVERLAP = float(st.secrets.get("CHANGE_FEED_OVERLAP", 300))
+NEWS_CACHE_TTL = int(st.secrets.get("NEWS_CACHE_TTL", 300))
+QUERY_LOG_PATH = st.secrets.get("QUERY_LOG_PATH", "query_log.jsonl")
+QUERY_LOG_MAX_BYTES = int(st.secrets.get("QUERY_LOG_MAX_BYTES", 5 * 1024 * 1024))
+QUERY_LOG_WINDOW = int(st.secrets.get("QUERY_LOG_WINDOW", 5000))
+WARMUP_TOP_QUERIES = int(st.secrets.get("WARMUP_TOP_QUERIES", 20))
+WARMUP_TOP_PAGES = int(st.secrets.get("WARMUP_TOP_PAGES", 50))
+WARMUP_REQUEST_BUDGET = int(st.secrets.get("WARMUP_REQUEST_BUDGET", 300))
+WARMUP_INTERVAL = float(st.secrets.get("WARMUP_INTERVAL", 240))
 
-# =================== ФУНКЦИИ ДЛЯ РАБОТЫ С NOTION ===================
-def extract_text_from_blocks(blocks):
-    """Извлекает текст из блоков Notion"""
-    text_parts = []
+def load_notion_workspaces():
+    """Собирает интеграции Notion из секретов: секция NOTION_WORKSPACES (имя = ключ) + NOTION_API_KEY"""
+    workspaces = {}
     
-    for block in blocks:
-        block_type = block.get('type')
-        
-        # Текстовые блоки
-        if block_type in ['paragraph', 'heading_1', 'heading_2', 'heading_3', 
-                         'bulleted_list_item', 'numbered_list_item', 'to_do', 
-                         'toggle', 'quote', 'callout']:
-            rich_text = block.get(block_type, {}).get('rich_text', [])
-            for text_item in rich_text:
-                if 'plain_text' in text_item:
-                    text_parts.append(text_item['plain_text'])
-        
-        # Код и формулы
-        elif block_type in ['code', 'equation']:
-            rich_text = block.get(block_type, {}).get('rich_text', [])
-            for text_item in rich_text:
-                if 'plain_text' in text_item:
-                    text_parts.append(text_item['plain_text'])
-        
-        # Таблицы
-        elif block_type == 'table':
-            table_rows = block.get('table', {}).get('children', [])
-            for row in table_rows:
-                cells = row.get('table_row', {}).get('cells', [])
-                for cell in cells:
-                    for text_item in cell:
-                        if 'plain_text' in text_item:
-                            text_parts.append(text_item['plain_text'])
-        
-        # Рекурсивно обрабатываем дочерние блоки
-        if block.get('has_children', False):
-            child_blocks = block.get('children', [])
-            child_text = extract_text_from_blocks(child_blocks)
-            text_parts.extend(child_text)
+    try:
+        configured = dict(st.secrets.get("NOTION_WORKSPACES", {}))
+    except Exception:
+        configured = {}
+    
+    for name, api_key in configured.items():
+        if api_key:
+            workspaces[name] = api_key
+    
+    # Старый одиночный ключ остается рабочим
+    if NOTION_API_KEY and NOTION_API_KEY not in workspaces.values():
+        workspaces.setdefault("default", NOTION_API_KEY)
     
-    return " ".join(text_parts)
+    return workspaces
+
+NOTION_WORKSPACES = load_notion_workspaces()
+if not NOTION_API_KEY and NOTION_WORKSPACES:
+    NOTION_API_KEY = next(iter(NOTION_WORKSPACES.values()))
+
+configure_rate_limits(NOTION_RATE_LIMIT, BACKGROUND_RATE_SHARE)
+
+# =================== ПУЛ ПРОЦЕССОВ ===================
+@st.cache_resource
+def get_process_pool(workers):
+    """Пул процессов для обработки текста, общий для всех перезапусков скрипта.
+    
+    spawn, а не fork: сервер Streamlit многопоточный, и fork копировал бы
+    чужие захваченные блокировки в дочерние процессы. Цена spawn: Streamlit
+    подменяет __main__ модулем скрипта, поэтому каждый воркер при старте один
+    раз выполняет этот файл как __mp_main__ (импорт streamlit, секреты,
+    set_page_config вне сервера). main() и фоновые потоки при этом не
+    запускаются. Воркеры живут столько же, сколько пул, так что это разовая
+    стоимость на процесс, а не на поиск.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
 
+def run_analysis(items, query, keep_all=False, executor=None):
+    """Обработка текста страниц; упавший пул пересоздается при следующем поиске"""
+    try:
+        return analyze_pages(items, query, keep_all=keep_all, executor=executor)
+    except BrokenProcessPool:
+        executor.shutdown(wait=False)
+        get_process_pool.clear()
+        return analyze_pages(items, query, keep_all=keep_all)
+
+# =================== ФОНОВОЕ ОБНОВЛЕНИЕ ===================
+def start_change_feeds():
+    """Запускает фоновое обновление корпуса для всех воркспейсов"""
+    if CHANGE_FEED_INTERVAL <= 0:
+        return
+    
+    for name, api_key in NOTION_WORKSPACES.items():
+        start_change_feed(
+            name,
+            api_key,
+            CHANGE_FEED_INTERVAL,
+            CHANGE_FEED_MAX_INTERVAL,
+            CHANGE_FEED_FULL_SYNC,
+            CHANGE_FEED_OVERLAP
+        )
+
+# =================== ФУНКЦИИ ДЛЯ РАБОТЫ С NOTION ===================
 def get_page_title(page_data):
     """Извлекает заголовок страницы"""
     try:
@@ -84,17 +149,13 @@ def get_page_title(page_data):
     except:
         return "Без названия"
 
-def smart_search_notion(query, search_mode="all"):
+def smart_search_notion(query, search_mode="all", api_key=None, workspace=None, executor=None):
     """Умный поиск в Notion"""
-    if not NOTION_API_KEY:
+    api_key = api_key or NOTION_API_KEY
+    if not api_key:
         return None, "❌ API ключ Notion не найден"
     
     results = []
-    headers = {
-        "Authorization": f"Bearer {NOTION_API_KEY}",
-        "Content-Type": "application/json",
-        "Notion-Version": "2022-06-28"
-    }
     
     # Разбиваем запрос на слова, убираем стоп-слова
     query_lower = query.lower()
@@ -122,13 +183,14 @@ def smart_search_notion(query, search_mode="all"):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=title_payload, timeout=20)
+        response = notion_request("POST", url, api_key, json=title_payload, timeout=20)
         
         if response.status_code == 200:
             data = response.json()
             pages = data.get("results", [])
             
-            # Процессим каждую страницу
+            # Сначала скачиваем все страницы, потом разом обрабатываем текст
+            candidates = []
             for page in pages:
                 try:
                     # Получаем заголовок
@@ -142,48 +204,52 @@ def smart_search_notion(query, search_mode="all"):
                     if not page_url or 'notion.so' not in page_url:
                         page_url = f"https://www.notion.so/{page_id.replace('-', '')}"
                     
-                    # Получаем содержимое страницы
-                    content_text, content_error = get_page_content(page_id)
-                    full_text = title + " " + (content_text if not content_error else "")
-                    
-                    # Проверяем релевантность
-                    relevance = calculate_relevance(full_text, query)
-                    
-                    # Если релевантность выше порога или ищем по всем
-                    if relevance > 0 or search_mode == "all":
-                        # Дата последнего редактирования
-                        last_edited = page.get('last_edited_time', '')
-                        if last_edited:
-                            try:
-                                dt = datetime.datetime.fromisoformat(last_edited.replace('Z', '+00:00'))
-                                last_edited = dt.strftime("%d.%m.%Y %H:%M")
-                            except:
-                                pass
-                        
-                        # Создаем сниппет
-                        snippet = create_smart_snippet(title, content_text if not content_error else "", query)
-                        
-                        results.append({
-                            'title': title,
-                            'content': content_text if not content_error else "",
-                            'snippet': snippet,
-                            'link': page_url,
-                            'source': 'Notion',
-                            'last_edited': last_edited,
-                            'id': page_id,
-                            'relevance': relevance,
-                            'found_in': "заголовок" if relevance > 0 and query.lower() in title.lower() else "содержимое"
-                        })
-                        
-                except Exception as e:
+                    # Получаем текст страницы (из корпуса, если он свежий)
+                    content_text = get_page_text(page, api_key, workspace) or ""
+                    candidates.append((page, title, page_id, page_url, content_text))
+                
+                except Exception:
                     continue
             
+            # CPU-этап: релевантность и сниппеты (текст извлечен при загрузке)
+            analyzed = run_analysis(
+                [(title, content_text) for _, title, _, _, content_text in candidates],
+                query,
+                keep_all=(search_mode == "all"),
+                executor=executor
+            )
+            
+            for (page, title, page_id, page_url, content_text), (relevance, snippet) in zip(candidates, analyzed):
+                # Если релевантность выше порога или ищем по всем
+                if relevance > 0 or search_mode == "all":
+                    # Дата последнего редактирования
+                    last_edited = page.get('last_edited_time', '')
+                    if last_edited:
+                        try:
+                            dt = datetime.datetime.fromisoformat(last_edited.replace('Z', '+00:00'))
+                            last_edited = dt.strftime("%d.%m.%Y %H:%M")
+                        except:
+                            pass
+                    
+                    results.append({
+                        'title': title,
+                        'content': content_text,
+                        'snippet': snippet,
+                        'link': page_url,
+                        'source': 'Notion',
+                        'last_edited': last_edited,
+                        'id': page_id,
+                        'workspace': workspace,
+                        'relevance': relevance,
+                        'found_in': "заголовок" if relevance > 0 and query.lower() in title.lower() else "содержимое"
+                    })
+            
             # Сортируем по релевантности
             results.sort(key=lambda x: x['relevance'], reverse=True)
             
             # Если не нашли по заголовкам, пробуем более глубокий поиск
             if not results and len(query_words) > 0:
-                return deep_content_search(query_words, headers)
+                return deep_content_search(query_words, api_key, workspace, executor)
             
             return results[:50], None
         
@@ -197,12 +263,12 @@ def smart_search_notion(query, search_mode="all"):
     except Exception as e:
         return None, f"❌ Ошибка подключения: {e}"
 
-def deep_content_search(query_words, headers):
+def deep_content_search(query_words, api_key, workspace=None, executor=None):
     """Глубокий поиск по содержимому всех страниц"""
     results = []
     
     try:
-        # Получаем все страницы
+        # Получаем все страницы (постранично, до DEEP_SEARCH_MAX_PAGES)
         url = "https://api.notion.com/v1/search"
         payload = {
             "filter": {"value": "page", "property": "object"},
@@ -210,194 +276,149 @@ def deep_content_search(query_words, headers):
             "sort": {"direction": "descending", "timestamp": "last_edited_time"}
         }
         
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
+        all_pages = []
+        while len(all_pages) < DEEP_SEARCH_MAX_PAGES:
+            response = notion_request("POST", url, api_key, json=payload, timeout=30)
+            if response.status_code != 200:
+                break
+            
             data = response.json()
-            all_pages = data.get("results", [])
+            all_pages.extend(data.get("results", []))
             
-            # Проверяем первые 30 страниц
-            for page in all_pages[:30]:
-                try:
-                    title = get_page_title(page)
-                    page_id = page.get('id', '')
-                    page_url = page.get('url', f"https://www.notion.so/{page_id.replace('-', '')}")
-                    
-                    # Получаем содержимое
-                    content, error = get_page_content(page_id)
-                    if error:
-                        continue
-                    
-                    full_text = (title + " " + content).lower()
-                    
-                    # Ищем каждое слово запроса
-                    found_words = 0
-                    for word in query_words:
-                        if word in full_text:
-                            found_words += 1
-                    
-                    # Если нашли хотя бы одно слово
-                    if found_words > 0:
-                        relevance = found_words * 10
-                        
-                        # Создаем сниппет
-                        snippet = create_smart_snippet(title, content, " ".join(query_words))
-                        
-                        results.append({
-                            'title': title,
-                            'content': content,
-                            'snippet': snippet,
-                            'link': page_url,
-                            'source': 'Notion',
-                            'id': page_id,
-                            'relevance': relevance,
-                            'found_in': "содержимое"
-                        })
-                        
-                except Exception:
-                    continue
+            if not data.get("has_more"):
+                break
+            payload["start_cursor"] = data.get("next_cursor")
+        
+        # Содержимое берем из локального корпуса; скачиваем на лету только
+        # первые DEEP_SEARCH_FETCH_LIMIT недостающих страниц, остальные
+        # подтянет фоновый поллер
+        candidates = []
+        fetched = 0
+        for page in all_pages[:DEEP_SEARCH_MAX_PAGES]:
+            try:
+                title = get_page_title(page)
+                page_id = page.get('id', '')
+                page_url = page.get('url', f"https://www.notion.so/{page_id.replace('-', '')}")
+                
+                # Получаем содержимое
+                content = get_page_text(page, api_key, workspace, fetch=False)
+                if content is None and fetched < DEEP_SEARCH_FETCH_LIMIT:
+                    content = get_page_text(page, api_key, workspace)
+                    fetched += 1
+                candidates.append((title, page_id, page_url, content or ""))
             
-            results.sort(key=lambda x: x['relevance'], reverse=True)
-            return results[:30], None
+            except Exception:
+                continue
+        
+        # Сниппеты строятся только для страниц, где нашлось хотя бы одно слово
+        analyzed = run_analysis(
+            [(title, content) for title, _, _, content in candidates],
+            " ".join(query_words),
+            executor=executor
+        )
+        
+        for (title, page_id, page_url, content), (relevance, snippet) in zip(candidates, analyzed):
+            # Релевантность считаем так же, как в поиске по заголовкам,
+            # иначе при слиянии выдачи разных воркспейсов глубокий поиск
+            # всегда оказывался бы внизу
+            if relevance > 0:
+                results.append({
+                    'title': title,
+                    'content': content,
+                    'snippet': snippet,
+                    'link': page_url,
+                    'source': 'Notion',
+                    'id': page_id,
+                    'workspace': workspace,
+                    'relevance': relevance,
+                    'found_in': "содержимое"
+                })
+        
+        results.sort(key=lambda x: x['relevance'], reverse=True)
+        return results[:30], None
     
     except Exception:
         pass
     
     return [], None
 
-def get_page_content(page_id):
-    """Получает содержимое страницы Notion"""
-    if not NOTION_API_KEY:
-        return "", "❌ API ключ Notion не найден"
-    
+def fetch_page_blocks(page_id, api_key):
+    """Скачивает блоки страницы Notion как сырые байты JSON"""
     try:
         url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-        headers = {
-            "Authorization": f"Bearer {NOTION_API_KEY}",
-            "Notion-Version": "2022-06-28"
-        }
-        
-        response = requests.get(url, headers=headers, timeout=15)
+        response = notion_request("GET", url, api_key, timeout=15)
         
         if response.status_code == 200:
-            data = response.json()
-            blocks = data.get('results', [])
-            text_content = extract_text_from_blocks(blocks)
-            return text_content, None
-        else:
-            return "", ""
-    
-    except Exception as e:
-        return "", ""
-
-def calculate_relevance(text, query):
-    """Вычисляет релевантность текста запросу"""
-    if not text or not query:
-        return 0
+            return response.content
     
-    text_lower = text.lower()
-    query_lower = query.lower()
-    
-    # Разбиваем запрос на слова
-    query_words = query_lower.split()
-    
-    # Если запрос одно слово
-    if len(query_words) == 1:
-        word = query_words[0]
-        if len(word) <= 2:
-            # Для коротких слов ищем точное вхождение
-            pattern = r'\b' + re.escape(word) + r'\b'
-            if re.search(pattern, text_lower):
-                return 100
-            elif word in text_lower:
-                return 50
-        else:
-            # Для длинных слов
-            if word in text_lower:
-                return 100
-    
-    # Для нескольких слов
-    score = 0
-    words_found = 0
-    
-    for word in query_words:
-        if len(word) > 0:
-            # Ищем слово с границами (целое слово)
-            pattern = r'\b' + re.escape(word) + r'\b'
-            if re.search(pattern, text_lower):
-                score += 30
-                words_found += 1
-            elif word in text_lower:
-                score += 15
-                words_found += 1
-    
-    # Бонус за нахождение всех слов
-    if words_found == len(query_words):
-        score += 50
-    
-    # Бонус за точную фразу
-    if query_lower in text_lower:
-        score += 100
-    
-    return score
-
-def create_smart_snippet(title, content, query, max_length=250):
-    """Создает умный сниппет с найденными словами"""
-    if not content:
-        return title[:150] + ("..." if len(title) > 150 else "")
-    
-    # Объединяем заголовок и содержимое
-    full_text = title + " " + content
-    full_text_lower = full_text.lower()
-    query_lower = query.lower()
-    query_words = [word for word in query_lower.split() if len(word) > 0]
+    except Exception:
+        pass
     
-    # Ищем лучшее место для сниппета
-    best_position = -1
-    best_score = 0
+    return None
+
+def get_page_text(page, api_key, workspace=None, fetch=True):
+    """Текст страницы из локального корпуса, а если копия устарела - из API"""
+    page_id = page.get('id', '')
+    last_edited = page.get('last_edited_time', '')
+    
+    text = CORPUS.get_text(page_id, last_edited)
+    if text is None and fetch:
+        fetched_minute = utc_minute()
+        raw_blocks = fetch_page_blocks(page_id, api_key)
+        if raw_blocks is not None:
+            text = text_from_raw_blocks(raw_blocks)
+            CORPUS.put(page_id, workspace, last_edited, text, fetched_minute)
+    
+    return text
+
+def search_all_workspaces(query, search_mode="all", top_k=50, executor=None):
+    """Параллельный поиск по всем интеграциям Notion с объединением top-k"""
+    if not NOTION_WORKSPACES:
+        return None, "❌ API ключ Notion не найден"
     
-    for i in range(0, len(full_text_lower) - 100, 50):
-        segment = full_text_lower[i:i+200]
-        score = 0
+    # Каждая интеграция ищет в своем потоке со своим лимитом,
+    # поэтому общее время ~ времени самого медленного воркспейса.
+    # Контекст копируется, чтобы запросы потоков учитывались в бюджете вызывающего
+    with ThreadPoolExecutor(max_workers=len(NOTION_WORKSPACES)) as thread_pool:
+        futures = [
+            (name, thread_pool.submit(
+                contextvars.copy_context().run,
+                cached_workspace_search, query, search_mode, name, api_key, executor
+            ))
+            for name, api_key in NOTION_WORKSPACES.items()
+        ]
+    
+    ranked_lists = []
+    errors = []
+    for name, future in futures:
+        try:
+            results, error = future.result()
+        except Exception as e:
+            results, error = None, f"❌ Ошибка подключения: {e}"
         
-        for word in query_words:
-            if word in segment:
-                score += 10
-                # Бонус за точное совпадение с границами слова
-                if re.search(r'\b' + re.escape(word) + r'\b', segment):
-                    score += 5
-        
-        if score > best_score:
-            best_score = score
-            best_position = i
-    
-    # Если не нашли хорошее место, берем начало
-    if best_position == -1 or best_score == 0:
-        snippet = content[:max_length]
-        if len(content) > max_length:
-            snippet += "..."
-        return snippet
-    
-    # Вырезаем сниппет вокруг лучшей позиции
-    start = max(0, best_position - 50)
-    end = min(len(full_text), best_position + 200)
-    
-    snippet = full_text[start:end]
-    
-    # Добавляем многоточия
-    if start > 0:
-        snippet = "..." + snippet
-    if end < len(full_text):
-        snippet = snippet + "..."
-    
-    # Подсвечиваем найденные слова
-    for word in query_words:
-        if len(word) > 0:
-            # Используем regex для поиска слова с любыми границами
-            pattern = r'(\b' + re.escape(word) + r'\b)'
-            snippet = re.sub(pattern, r'**\1**', snippet, flags=re.IGNORECASE)
-    
-    return snippet
+        if error:
+            errors.append(error if len(NOTION_WORKSPACES) == 1 else f"{name}: {error}")
+        if results:
+            ranked_lists.append(results)
+    
+    if not ranked_lists and errors:
+        return None, "; ".join(errors)
+    
+    # Списки уже отсортированы по убыванию релевантности - сливаем кучей.
+    # Одну страницу могут видеть несколько интеграций: первая копия в
+    # слиянии самая релевантная, остальные пропускаем
+    merged = heapq.merge(*ranked_lists, key=lambda x: -x['relevance'])
+    results = []
+    seen_ids = set()
+    for page in merged:
+        if page['id'] in seen_ids:
+            continue
+        seen_ids.add(page['id'])
+        results.append(page)
+        if len(results) >= top_k:
+            break
+    
+    return results, ("; ".join(errors) if errors else None)
 
 def fetch_google_news(search_query):
     """Поиск новостей через Serper API"""
@@ -453,8 +474,213 @@ def fetch_google_news(search_query):
     except Exception as e:
         return None, f"❌ Ошибка подключения: {e}"
 
+# =================== КЭШИ ===================
+def cached_workspace_search(query, search_mode, workspace, api_key, executor=None):
+    """Поиск в одном воркспейсе через кэш выдачи.
+    
+    Запись живет без TTL, пока не изменится поколение воркспейса в корпусе:
+    правки в других воркспейсах ее не сбрасывают. Ошибки не кэшируются.
+    """
+    key = ("notion", workspace, query, search_mode)
+    generation = CORPUS.generation(workspace)
+    
+    results = RESULT_CACHE.get(key, generation)
+    if results is not None:
+        return results, None
+    
+    results, error = smart_search_notion(query, search_mode, api_key, workspace, executor)
+    
+    # Прогрев мог не уложиться в бюджет - неполную выдачу не кэшируем
+    budget = REQUEST_BUDGET.get()
+    if budget is not None and budget.refused:
+        return results, f"❌ Бюджет {budget.limit} запросов исчерпан"
+    
+    if not error:
+        RESULT_CACHE.put(key, results, generation)
+    return results, error
+
+def cached_google_news(search_query, max_age=NEWS_CACHE_TTL):
+    """Поиск новостей через кэш выдачи; ошибки не кэшируются"""
+    key = ("news", search_query)
+    
+    articles = RESULT_CACHE.get(key, max_age=max_age)
+    if articles is not None:
+        return articles, None
+    
+    articles, error = fetch_google_news(search_query)
+    if not error:
+        RESULT_CACHE.put(key, articles)
+    return articles, error
+
+def prefetch_page(page_id, workspace):
+    """Загружает страницу в локальный корпус, если ее там нет или она устарела"""
+    api_key = NOTION_WORKSPACES.get(workspace)
+    if not api_key:
+        return
+    
+    try:
+        response = notion_request("GET", f"https://api.notion.com/v1/pages/{page_id}", api_key, timeout=15)
+        if response.status_code == 200:
+            get_page_text(response.json(), api_key, workspace)
+    except Exception:
+        pass
+
+# =================== ЖУРНАЛ ЗАПРОСОВ ===================
+QUERY_LOG_LOCK = threading.Lock()
+
+def append_query_log(record):
+    """Дописывает запись в журнал (одна строка JSON на событие)"""
+    record = dict(record, ts=datetime.datetime.now(datetime.timezone.utc).isoformat())
+    line = json.dumps(record, ensure_ascii=False)
+    
+    try:
+        with QUERY_LOG_LOCK:
+            with open(QUERY_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            
+            # Журнал не растет бесконечно: старая часть уходит в .1
+            if os.path.getsize(QUERY_LOG_PATH) > QUERY_LOG_MAX_BYTES:
+                os.replace(QUERY_LOG_PATH, QUERY_LOG_PATH + ".1")
+    except OSError:
+        pass
+
+def log_query(query, search_mode, latency, notion_results):
+    """Записывает поисковый запрос, его время и найденные страницы"""
+    append_query_log({
+        'type': 'query',
+        'query': query,
+        'mode': search_mode,
+        'latency_ms': round(latency * 1000),
+        'results': [[page.get('workspace'), page['id']] for page in notion_results or []]
+    })
+
+def log_click(query, page):
+    """Записывает интерес пользователя к конкретной странице"""
+    append_query_log({
+        'type': 'click',
+        'query': query,
+        'workspace': page.get('workspace'),
+        'id': page['id'],
+        'link': page['link']
+    })
+
+def read_tail_lines(path, limit, block_size=65536):
+    """Последние limit строк файла: читает блоками с конца, а не весь файл"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            
+            while position > 0 and data.count(b"\n") <= limit:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+    except OSError:
+        return []
+    
+    lines = data.splitlines()
+    # Первая строка блока может быть обрезана
+    if position > 0:
+        lines = lines[1:]
+    return lines[-limit:] if limit > 0 else []
+
+def read_query_log(limit=QUERY_LOG_WINDOW):
+    """Читает последние записи журнала (с учетом предыдущего файла после ротации)"""
+    lines = read_tail_lines(QUERY_LOG_PATH, limit)
+    if len(lines) < limit:
+        lines = read_tail_lines(QUERY_LOG_PATH + ".1", limit - len(lines)) + lines
+    
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+def get_hot_queries_and_pages(records, top_queries, top_pages):
+    """Самые частые запросы и самые востребованные страницы"""
+    query_hits = Counter()
+    page_hits = Counter()
+    
+    for record in records:
+        if record.get('type') == 'query':
+            query_hits[(record.get('query', ''), record.get('mode', 'deep'))] += 1
+            # Учитываем только верх выдачи - его реально открывают
+            for workspace, page_id in record.get('results', [])[:10]:
+                page_hits[(workspace, page_id)] += 1
+        elif record.get('type') == 'click':
+            # Клик весомее простого показа в выдаче
+            page_hits[(record.get('workspace'), record.get('id'))] += 3
+    
+    hot_queries = [key for key, _ in query_hits.most_common(top_queries) if key[0]]
+    hot_pages = [key for key, _ in page_hits.most_common(top_pages) if key[1]]
+    return hot_queries, hot_pages
+
+# =================== ПРОГРЕВ КЭШЕЙ ===================
+def warm_caches():
+    """Прогревает корпус и кэши по журналу запросов в рамках бюджета"""
+    budget = RequestBudget(WARMUP_REQUEST_BUDGET)
+    token = REQUEST_BUDGET.set(budget)
+    background_token = BACKGROUND_REQUESTS.set(True)
+    
+    try:
+        hot_queries, hot_pages = get_hot_queries_and_pages(
+            read_query_log(), WARMUP_TOP_QUERIES, WARMUP_TOP_PAGES
+        )
+        
+        # Сначала страницы - они дешевые и ускоряют последующие запросы
+        for workspace, page_id in hot_pages:
+            if budget.exhausted:
+                break
+            prefetch_page(page_id, workspace)
+        
+        for query, search_mode in hot_queries:
+            if budget.exhausted:
+                break
+            
+            # Выдача Notion пересчитывается, только если ее сбросило поколение
+            search_all_workspaces(query, search_mode)
+            
+            # Новости обновляем заранее, если до следующего прогрева они истекут
+            if SERPER_API_KEY:
+                budget.spend()
+                cached_google_news(query, max_age=max(NEWS_CACHE_TTL - WARMUP_INTERVAL, 0))
+    
+    except RequestBudgetExceeded:
+        pass
+    
+    finally:
+        BACKGROUND_REQUESTS.reset(background_token)
+        REQUEST_BUDGET.reset(token)
+    
+    return budget.used
+
+def run_cache_warmer():
+    """Прогрев при старте и затем по расписанию"""
+    while True:
+        try:
+            warm_caches()
+        except Exception:
+            pass
+        
+        if WARMUP_INTERVAL <= 0:
+            return
+        time.sleep(WARMUP_INTERVAL)
+
+def start_cache_warmer():
+    """Запускает поток прогрева, если он еще не работает в этом процессе"""
+    if WARMUP_REQUEST_BUDGET > 0:
+        start_background_thread("cache-warmer", run_cache_warmer)
+
 # =================== ОСНОВНОЙ ИНТЕРФЕЙС ===================
 def main():
+    # Фоновое обновление корпуса и прогрев кэшей (стартуют один раз на процесс)
+    start_change_feeds()
+    start_cache_warmer()
+    
     # Заголовок приложения
     st.title("🔍 Умный поиск по Notion")
     st.markdown("Ищет по **названиям и содержимому** ваших страниц")
@@ -469,7 +695,10 @@ def main():
     
     with col1:
         st.write("**Notion:**")
-        st.write("✅" if NOTION_API_KEY else "❌")
+        st.write(f"✅ ×{len(NOTION_WORKSPACES)}" if NOTION_WORKSPACES else "❌")
+    
+    if NOTION_WORKSPACES:
+        st.sidebar.caption(f"📦 Локальный корпус: {len(CORPUS)} страниц")
     
     with col2:
         st.write("**Google News:**")
@@ -489,6 +718,14 @@ def main():
     limit_medium = st.sidebar.slider("Средняя релевантность", 0, 50, 50, help="Макс. страниц для показа")
     limit_low = st.sidebar.slider("Низкая релевантность", 0, 50, 50, help="Макс. страниц для показа")
     
+    # Производительность
+    st.sidebar.subheader("⚡ Производительность")
+    use_process_pool = st.sidebar.checkbox(
+        "Обработка текста на всех ядрах",
+        value=CPU_WORKERS > 0,
+        help="Извлечение текста, релевантность и сниппеты в пуле процессов"
+    )
+    
     # Инструкция
     with st.sidebar.expander("📖 Как пользоваться"):
         st.markdown("""
@@ -528,10 +765,18 @@ def main():
             mode = "deep" if "Глубокий" in search_mode else "title"
             
             # Поиск в Notion
-            notion_results, notion_error = smart_search_notion(query, mode)
+            # Пул процессов создается один раз и переживает перезапуски скрипта
+            executor = None
+            if use_process_pool:
+                executor = get_process_pool(CPU_WORKERS or os.cpu_count() or 1)
+            
+            started = time.perf_counter()
+            notion_results, notion_error = search_all_workspaces(query, mode, executor=executor)
             
             # Поиск новостей
-            news_results, news_error = fetch_google_news(query)
+            news_results, news_error = cached_google_news(query)
+            
+            log_query(query, mode, time.perf_counter() - started, notion_results)
         
         # ========== РЕЗУЛЬТАТЫ ==========
         if notion_error:
@@ -586,7 +831,7 @@ def main():
                             show_page_result(page, query)
                         shown_low += 1
         
-        elif NOTION_API_KEY:
+        elif NOTION_WORKSPACES:
             st.info("😔 По вашему запросу ничего не найдено")
             st.markdown("""
             **Возможные причины:**
@@ -630,6 +875,8 @@ def show_page_result(page, query):
     with col2:
         if page.get('found_in'):
             st.caption(f"📍 Найдено в: {page['found_in']}")
+        if page.get('workspace') and len(NOTION_WORKSPACES) > 1:
+            st.caption(f"🗂 Воркспейс: {page['workspace']}")
     
     # Сниппет
     if page['snippet']:
@@ -684,7 +931,7 @@ def show_page_result(page, query):
     
     with link_col2:
         if page['content'] and len(page['content']) > 50:
-            if st.button("📄 Показать больше текста", key=f"more_{page['id']}"):
+            if st.button("📄 Показать больше текста", key=f"more_{page.get('workspace')}_{page['id']}", on_click=log_click, args=(query, page)):
                 # Показываем первые 500 символов
                 preview = page['content'][:500]
                 if len(page['content']) > 500:
@@ -720,8 +967,8 @@ def show_welcome_screen():
     """)
     
     # Статистика
-    if NOTION_API_KEY:
-        st.success("✅ Notion API подключен")
+    if NOTION_WORKSPACES:
+        st.success(f"✅ Notion API подключен (воркспейсов: {len(NOTION_WORKSPACES)})")
     else:
         st.warning("⚠️ Notion API не настроен")
 
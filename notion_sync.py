@@ -0,0 +1,466 @@
+"""Доступ к Notion API, локальный корпус страниц и кэш выдачи.
+
+Лимитеры запросов, корпус, фоновые потоки и кэш выдачи живут в обычном
+импортируемом модуле: Streamlit не перевыполняет его при перезапуске
+скрипта, а "Clear cache" его не сбрасывает. Поэтому на процесс приходится
+ровно один лимитер на интеграцию и ровно один поток каждого вида.
+"""
+import contextvars
+import datetime
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from notion_text import text_from_raw_blocks
+
+# =================== ЛИМИТЫ ЗАПРОСОВ ===================
+class RateBudget:
+    """Лимитер запросов одной интеграции: не чаще rate запросов в секунду.
+    
+    Фоновые запросы получают не больше background_share от лимита и только
+    свободные слоты, поэтому интерактивный поиск их не ждет.
+    """
+    
+    def __init__(self, rate, background_share=1.0):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.background_interval = self.interval / background_share if background_share > 0 else self.interval
+        self.next_time = 0.0
+        self.next_background_time = 0.0
+        self.lock = threading.Lock()
+    
+    def acquire(self, background=False):
+        """Ждет, пока в бюджете не появится слот для запроса"""
+        if background:
+            self.acquire_background()
+            return
+        
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        
+        if wait > 0:
+            time.sleep(wait)
+    
+    def acquire_background(self):
+        """Занимает слот, только если он свободен прямо сейчас"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # Интерактивные запросы в очереди сдвигают next_time вперед,
+                # так что фон пропускает их вперед себя
+                if self.next_time <= now and self.next_background_time <= now:
+                    self.next_time = now + self.interval
+                    self.next_background_time = now + self.background_interval
+                    return
+                wait = max(self.next_time, self.next_background_time) - now
+            
+            time.sleep(max(wait, 0.01))
+
+# Настройки лимитеров; применяются к интеграциям, которых еще нет в реестре
+RATE_LIMIT = 3.0
+BACKGROUND_RATE_SHARE = 0.5
+
+RATE_BUDGETS = {}
+RATE_BUDGETS_LOCK = threading.Lock()
+
+# Фоновая задача (поллер, прогрев): ее запросы идут с низким приоритетом
+BACKGROUND_REQUESTS = contextvars.ContextVar("BACKGROUND_REQUESTS", default=False)
+
+def configure_rate_limits(rate, background_share):
+    """Задает лимит запросов в секунду и долю фона"""
+    global RATE_LIMIT, BACKGROUND_RATE_SHARE
+    RATE_LIMIT = rate
+    BACKGROUND_RATE_SHARE = background_share
+
+def get_rate_budget(api_key):
+    """Возвращает лимитер для конкретной интеграции"""
+    with RATE_BUDGETS_LOCK:
+        if api_key not in RATE_BUDGETS:
+            RATE_BUDGETS[api_key] = RateBudget(RATE_LIMIT, BACKGROUND_RATE_SHARE)
+        return RATE_BUDGETS[api_key]
+
+class RequestBudgetExceeded(Exception):
+    """Бюджет запросов фоновой задачи исчерпан"""
+
+class RequestBudget:
+    """Счетчик запросов фоновой задачи с верхней границей"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.refused = False
+        self.lock = threading.Lock()
+    
+    def spend(self, count=1):
+        """Списывает запросы или отказывает, если бюджет уже исчерпан"""
+        with self.lock:
+            if self.used + count > self.limit:
+                self.refused = True
+                raise RequestBudgetExceeded(f"Бюджет {self.limit} запросов исчерпан")
+            self.used += count
+    
+    @property
+    def exhausted(self):
+        return self.used >= self.limit
+
+# Бюджет текущей задачи (прогрев кэшей); у обычных запросов его нет
+REQUEST_BUDGET = contextvars.ContextVar("REQUEST_BUDGET", default=None)
+
+def notion_headers(api_key):
+    """Заголовки запроса к Notion API"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Notion-Version": "2022-06-28"
+    }
+
+def notion_request(method, url, api_key, **kwargs):
+    """Запрос к Notion API с учетом лимита интеграции"""
+    budget = REQUEST_BUDGET.get()
+    if budget is not None:
+        budget.spend()
+    
+    get_rate_budget(api_key).acquire(background=BACKGROUND_REQUESTS.get())
+    return requests.request(method, url, headers=notion_headers(api_key), **kwargs)
+
+# =================== ЛОКАЛЬНЫЙ КОРПУС ===================
+def utc_minute():
+    """Текущая минута UTC в формате начала last_edited_time Notion"""
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M")
+
+def shift_timestamp(timestamp, seconds):
+    """Сдвигает last_edited_time Notion на seconds секунд"""
+    try:
+        dt = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return timestamp
+    
+    shifted = dt + datetime.timedelta(seconds=seconds)
+    return shifted.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+def is_settled(entry):
+    """Копия надежна, только если скачана в более позднюю минуту, чем правка.
+    
+    Notion округляет last_edited_time до минуты, и повторная правка в ту же
+    минуту не меняет отметку времени.
+    """
+    return entry['fetched_minute'] > entry['last_edited_time'][:16]
+
+class NotionCorpus:
+    """Локальная копия страниц Notion: id -> время правки и извлеченный текст"""
+    
+    def __init__(self):
+        self.pages = {}
+        self.generations = {}
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        with self.lock:
+            return len(self.pages)
+    
+    def __contains__(self, page_id):
+        with self.lock:
+            return page_id in self.pages
+    
+    def generation(self, workspace):
+        """Поколение воркспейса: растет при каждом изменении его содержимого"""
+        with self.lock:
+            return self.generations.get(workspace, 0)
+    
+    def get_text(self, page_id, last_edited):
+        """Возвращает текст, только если копия не старее страницы"""
+        with self.lock:
+            entry = self.pages.get(page_id)
+        
+        if entry and entry['last_edited_time'] == last_edited and is_settled(entry):
+            return entry['text']
+        return None
+    
+    def needs_update(self, page_id, last_edited):
+        """Проверяет, нужно ли заново скачать страницу"""
+        with self.lock:
+            entry = self.pages.get(page_id)
+        return not entry or entry['last_edited_time'] != last_edited or not is_settled(entry)
+    
+    def unsettled(self, workspace):
+        """Страницы, скачанные в минуту правки, которые уже можно перекачать"""
+        now_minute = utc_minute()
+        with self.lock:
+            return [
+                (page_id, entry['last_edited_time'])
+                for page_id, entry in self.pages.items()
+                if entry['workspace'] == workspace
+                and not is_settled(entry)
+                and now_minute > entry['last_edited_time'][:16]
+            ]
+    
+    def bump(self, workspace):
+        """Отмечает изменение в воркспейсе: кэш выдачи ключуется его поколением"""
+        with self.lock:
+            self._bump(workspace)
+    
+    def _bump(self, workspace):
+        self.generations[workspace] = self.generations.get(workspace, 0) + 1
+    
+    def put(self, page_id, workspace, last_edited, text, fetched_minute=None):
+        """Сохраняет текст страницы (fetched_minute - минута начала запроса)"""
+        with self.lock:
+            # Сравниваем извлеченный текст, а не сырой ответ: в нем есть
+            # request_id и подписанные ссылки, которые меняются при каждом запросе
+            entry = self.pages.get(page_id)
+            if entry and entry['text'] != text:
+                self._bump(workspace)
+            
+            self.pages[page_id] = {
+                'workspace': workspace,
+                'last_edited_time': last_edited,
+                'fetched_minute': fetched_minute or utc_minute(),
+                'text': text
+            }
+    
+    def remove(self, page_id):
+        """Удаляет страницу, возвращает True, если она была в корпусе"""
+        with self.lock:
+            entry = self.pages.pop(page_id, None)
+            if entry is not None:
+                self._bump(entry['workspace'])
+            return entry is not None
+    
+    def prune(self, workspace, seen_ids):
+        """Удаляет страницы воркспейса, которых больше нет в выдаче Notion"""
+        with self.lock:
+            stale = [
+                page_id for page_id, entry in self.pages.items()
+                if entry['workspace'] == workspace and page_id not in seen_ids
+            ]
+            for page_id in stale:
+                del self.pages[page_id]
+            if stale:
+                self._bump(workspace)
+        return len(stale)
+
+CORPUS = NotionCorpus()
+
+# =================== ФОНОВОЕ ОБНОВЛЕНИЕ ===================
+class ChangeFeedPoller:
+    """Фоновый опрос /v1/search по last_edited_time для одного воркспейса"""
+    
+    def __init__(self, workspace, api_key, corpus, interval, max_interval, full_sync_interval, overlap):
+        self.workspace = workspace
+        self.api_key = api_key
+        self.corpus = corpus
+        self.interval = interval
+        self.max_interval = max_interval
+        self.full_sync_interval = full_sync_interval
+        self.overlap = overlap
+        self.watermark = None
+        self.last_full_sync = 0.0
+        self.pending = set()
+        self.queue = queue.Queue()
+    
+    def start(self):
+        """Запускает потоки опроса и повторного извлечения"""
+        for target in (self.run_poll_loop, self.run_extract_loop):
+            threading.Thread(target=target, daemon=True).start()
+    
+    def poll_once(self):
+        """Один проход по ленте изменений, возвращает число изменений"""
+        # Полный проход нужен, чтобы заметить удаленные страницы:
+        # в ленте изменений их просто нет
+        full_sync = (
+            self.watermark is None
+            or time.monotonic() - self.last_full_sync >= self.full_sync_interval
+        )
+        
+        url = "https://api.notion.com/v1/search"
+        payload = {
+            "filter": {"value": "page", "property": "object"},
+            "page_size": 100,
+            "sort": {"direction": "descending", "timestamp": "last_edited_time"}
+        }
+        
+        changed = 0
+        seen_ids = set()
+        newest = self.watermark
+        previous_watermark = self.watermark
+        
+        # Индекс поиска Notion обновляется с задержкой: правка может появиться
+        # в ленте уже после более новой. Поэтому просматриваем ленту с запасом
+        # ниже водяного знака; повторы отсекают needs_update и pending
+        stop_at = shift_timestamp(self.watermark, -self.overlap) if self.watermark else None
+        
+        while True:
+            response = notion_request("POST", url, self.api_key, json=payload, timeout=30)
+            if response.status_code != 200:
+                # Водяной знак не двигаем - повторим в следующий раз
+                return changed
+            
+            data = response.json()
+            reached_watermark = False
+            
+            for page in data.get("results", []):
+                page_id = page.get('id', '')
+                last_edited = page.get('last_edited_time', '')
+                
+                # Дальше идут только страницы, которые мы уже видели
+                if not full_sync and last_edited < stop_at:
+                    reached_watermark = True
+                    break
+                
+                seen_ids.add(page_id)
+                if newest is None or last_edited > newest:
+                    newest = last_edited
+                
+                # Новая или измененная страница: кэшированная выдача устарела,
+                # даже если поиск уже успел сам положить ее в корпус
+                if previous_watermark is not None and (last_edited > previous_watermark or page_id not in self.corpus):
+                    self.corpus.bump(self.workspace)
+                
+                # Архивные и удаленные в корзину страницы убираем из корпуса
+                if page.get('archived') or page.get('in_trash'):
+                    if self.corpus.remove(page_id):
+                        changed += 1
+                    continue
+                
+                if (page_id, last_edited) not in self.pending and self.corpus.needs_update(page_id, last_edited):
+                    self.pending.add((page_id, last_edited))
+                    self.queue.put((page_id, last_edited))
+                    changed += 1
+            
+            if reached_watermark or not data.get("has_more"):
+                break
+            payload["start_cursor"] = data.get("next_cursor")
+        
+        # Страницы ниже водяного знака, скачанные в минуту своей правки,
+        # лента больше не покажет - перекачиваем их явно
+        for page_id, last_edited in self.corpus.unsettled(self.workspace):
+            if (page_id, last_edited) not in self.pending:
+                self.pending.add((page_id, last_edited))
+                self.queue.put((page_id, last_edited))
+                changed += 1
+        
+        if full_sync:
+            changed += self.corpus.prune(self.workspace, seen_ids)
+            self.last_full_sync = time.monotonic()
+        
+        self.watermark = newest
+        return changed
+    
+    def run_poll_loop(self):
+        """Опрашивает ленту, увеличивая интервал, пока в воркспейсе тихо"""
+        BACKGROUND_REQUESTS.set(True)
+        interval = self.interval
+        
+        while True:
+            try:
+                changed = self.poll_once()
+            except Exception:
+                changed = 0
+            
+            interval = self.interval if changed else min(interval * 2, self.max_interval)
+            time.sleep(interval)
+    
+    def run_extract_loop(self):
+        """Скачивает измененные страницы из очереди и сразу извлекает текст"""
+        BACKGROUND_REQUESTS.set(True)
+        
+        while True:
+            page_id, last_edited = self.queue.get()
+            
+            try:
+                fetched_minute = utc_minute()
+                url = f"https://api.notion.com/v1/blocks/{page_id}/children"
+                response = notion_request("GET", url, self.api_key, timeout=15)
+                
+                if response.status_code == 200:
+                    text = text_from_raw_blocks(response.content)
+                    self.corpus.put(page_id, self.workspace, last_edited, text, fetched_minute)
+                elif response.status_code == 404:
+                    self.corpus.remove(page_id)
+            
+            except Exception:
+                pass
+            
+            finally:
+                self.pending.discard((page_id, last_edited))
+                self.queue.task_done()
+
+POLLERS = {}
+POLLERS_LOCK = threading.Lock()
+
+def start_change_feed(workspace, api_key, interval, max_interval, full_sync_interval, overlap):
+    """Запускает поллер интеграции, если он еще не запущен в этом процессе"""
+    with POLLERS_LOCK:
+        if api_key in POLLERS:
+            return POLLERS[api_key]
+        
+        poller = ChangeFeedPoller(
+            workspace,
+            api_key,
+            CORPUS,
+            interval,
+            max_interval,
+            full_sync_interval,
+            overlap
+        )
+        poller.start()
+        POLLERS[api_key] = poller
+        return poller
+
+BACKGROUND_THREADS = {}
+BACKGROUND_THREADS_LOCK = threading.Lock()
+
+def start_background_thread(name, target):
+    """Запускает фоновый поток, если поток с таким именем еще не работает"""
+    with BACKGROUND_THREADS_LOCK:
+        thread = BACKGROUND_THREADS.get(name)
+        if thread is not None and thread.is_alive():
+            return thread
+        
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        BACKGROUND_THREADS[name] = thread
+        return thread
+
+# =================== КЭШ ВЫДАЧИ ===================
+class ResultCache:
+    """Кэш выдачи на процесс: ключ -> (версия, время записи, значение).
+    
+    Запись недействительна, если у нее другая версия (поколение воркспейса)
+    или она старше max_age. Прогрев перезаписывает записи заранее.
+    """
+    
+    def __init__(self, max_entries=1000):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+    
+    def get(self, key, version=None, max_age=None):
+        """Возвращает значение или None, если записи нет или она устарела"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            
+            entry_version, stored_at, value = entry
+            if entry_version != version:
+                return None
+            if max_age is not None and time.monotonic() - stored_at > max_age:
+                return None
+            
+            self.entries.move_to_end(key)
+            return value
+    
+    def put(self, key, value, version=None):
+        """Сохраняет значение, вытесняя самые давно использованные записи"""
+        with self.lock:
+            self.entries[key] = (version, time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,206 @@
+"""Обработка текста Notion: извлечение, релевантность, сниппеты.
+
+Вынесено из news_search_app.py в отдельный модуль без зависимости от
+Streamlit, чтобы функции можно было запускать в пуле процессов.
+"""
+import json
+import re
+from itertools import repeat
+
+# =================== ИЗВЛЕЧЕНИЕ ТЕКСТА ===================
+def extract_text_from_blocks(blocks):
+    """Извлекает текст из блоков Notion"""
+    text_parts = []
+    
+    for block in blocks:
+        block_type = block.get('type')
+        
+        # Текстовые блоки
+        if block_type in ['paragraph', 'heading_1', 'heading_2', 'heading_3', 
+                         'bulleted_list_item', 'numbered_list_item', 'to_do', 
+                         'toggle', 'quote', 'callout']:
+            rich_text = block.get(block_type, {}).get('rich_text', [])
+            for text_item in rich_text:
+                if 'plain_text' in text_item:
+                    text_parts.append(text_item['plain_text'])
+        
+        # Код и формулы
+        elif block_type in ['code', 'equation']:
+            rich_text = block.get(block_type, {}).get('rich_text', [])
+            for text_item in rich_text:
+                if 'plain_text' in text_item:
+                    text_parts.append(text_item['plain_text'])
+        
+        # Таблицы
+        elif block_type == 'table':
+            table_rows = block.get('table', {}).get('children', [])
+            for row in table_rows:
+                cells = row.get('table_row', {}).get('cells', [])
+                for cell in cells:
+                    for text_item in cell:
+                        if 'plain_text' in text_item:
+                            text_parts.append(text_item['plain_text'])
+        
+        # Рекурсивно обрабатываем дочерние блоки
+        if block.get('has_children', False):
+            child_blocks = block.get('children', [])
+            child_text = extract_text_from_blocks(child_blocks)
+            text_parts.extend(child_text)
+    
+    return " ".join(text_parts)
+
+def text_from_raw_blocks(raw_blocks):
+    """Извлекает текст из сырого JSON ответа /v1/blocks/{id}/children"""
+    if not raw_blocks:
+        return ""
+    
+    try:
+        blocks = json.loads(raw_blocks).get('results', [])
+        return extract_text_from_blocks(blocks)
+    except Exception:
+        return ""
+
+# =================== РЕЛЕВАНТНОСТЬ И СНИППЕТЫ ===================
+def calculate_relevance(text, query):
+    """Вычисляет релевантность текста запросу"""
+    if not text or not query:
+        return 0
+    
+    text_lower = text.lower()
+    query_lower = query.lower()
+    
+    # Разбиваем запрос на слова
+    query_words = query_lower.split()
+    
+    # Если запрос одно слово
+    if len(query_words) == 1:
+        word = query_words[0]
+        if len(word) <= 2:
+            # Для коротких слов ищем точное вхождение
+            pattern = r'\b' + re.escape(word) + r'\b'
+            if re.search(pattern, text_lower):
+                return 100
+            elif word in text_lower:
+                return 50
+        else:
+            # Для длинных слов
+            if word in text_lower:
+                return 100
+    
+    # Для нескольких слов
+    score = 0
+    words_found = 0
+    
+    for word in query_words:
+        if len(word) > 0:
+            # Ищем слово с границами (целое слово)
+            pattern = r'\b' + re.escape(word) + r'\b'
+            if re.search(pattern, text_lower):
+                score += 30
+                words_found += 1
+            elif word in text_lower:
+                score += 15
+                words_found += 1
+    
+    # Бонус за нахождение всех слов
+    if words_found == len(query_words):
+        score += 50
+    
+    # Бонус за точную фразу
+    if query_lower in text_lower:
+        score += 100
+    
+    return score
+
+def create_smart_snippet(title, content, query, max_length=250):
+    """Создает умный сниппет с найденными словами"""
+    if not content:
+        return title[:150] + ("..." if len(title) > 150 else "")
+    
+    # Объединяем заголовок и содержимое
+    full_text = title + " " + content
+    full_text_lower = full_text.lower()
+    query_lower = query.lower()
+    query_words = [word for word in query_lower.split() if len(word) > 0]
+    
+    # Ищем лучшее место для сниппета
+    best_position = -1
+    best_score = 0
+    
+    for i in range(0, len(full_text_lower) - 100, 50):
+        segment = full_text_lower[i:i+200]
+        score = 0
+        
+        for word in query_words:
+            if word in segment:
+                score += 10
+                # Бонус за точное совпадение с границами слова
+                if re.search(r'\b' + re.escape(word) + r'\b', segment):
+                    score += 5
+        
+        if score > best_score:
+            best_score = score
+            best_position = i
+    
+    # Если не нашли хорошее место, берем начало
+    if best_position == -1 or best_score == 0:
+        snippet = content[:max_length]
+        if len(content) > max_length:
+            snippet += "..."
+        return snippet
+    
+    # Вырезаем сниппет вокруг лучшей позиции
+    start = max(0, best_position - 50)
+    end = min(len(full_text), best_position + 200)
+    
+    snippet = full_text[start:end]
+    
+    # Добавляем многоточия
+    if start > 0:
+        snippet = "..." + snippet
+    if end < len(full_text):
+        snippet = snippet + "..."
+    
+    # Подсвечиваем найденные слова
+    for word in query_words:
+        if len(word) > 0:
+            # Используем regex для поиска слова с любыми границами
+            pattern = r'(\b' + re.escape(word) + r'\b)'
+            snippet = re.sub(pattern, r'**\1**', snippet, flags=re.IGNORECASE)
+    
+    return snippet
+
+# =================== ОБРАБОТКА В ПУЛЕ ПРОЦЕССОВ ===================
+def analyze_page(title, content, query, keep_all=False):
+    """Считает релевантность и сниппет страницы по уже извлеченному тексту"""
+    relevance = calculate_relevance(title + " " + content, query)
+    
+    # Сниппет нужен только для страниц, которые попадут в выдачу
+    snippet = None
+    if relevance > 0 or keep_all:
+        snippet = create_smart_snippet(title, content, query)
+    
+    return relevance, snippet
+
+def analyze_chunk(chunk, query, keep_all=False):
+    """Обрабатывает пачку страниц: (заголовок, текст) в байтах UTF-8"""
+    return [
+        analyze_page(title.decode('utf-8'), content.decode('utf-8'), query, keep_all)
+        for title, content in chunk
+    ]
+
+def analyze_pages(items, query, keep_all=False, executor=None, chunk_size=16):
+    """Обрабатывает страницы по порядку, при наличии пула - пачками по ядрам"""
+    # Для маленькой выдачи накладные расходы на процессы не окупаются
+    if executor is None or len(items) < 2 * chunk_size:
+        return [analyze_page(title, content or "", query, keep_all) for title, content in items]
+    
+    # В процессы уходит только текст в байтах, а не словари из API
+    encoded = [(title.encode('utf-8'), (content or "").encode('utf-8')) for title, content in items]
+    chunks = [encoded[i:i + chunk_size] for i in range(0, len(encoded), chunk_size)]
+    
+    # map сохраняет порядок пачек, поэтому результат детерминирован
+    results = []
+    for chunk_result in executor.map(analyze_chunk, chunks, repeat(query), repeat(keep_all)):
+        results.extend(chunk_result)
+    return results